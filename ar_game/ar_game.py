@@ -1,7 +1,8 @@
-import math
+import argparse
 import time
 import random
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
@@ -11,11 +12,16 @@ import pyglet
 from helpers import (
     SCREEN_WIDTH,
     SCREEN_HEIGHT,
-    loadImg,
+    openCameraDevice,
+    decodeImgPixels,
+    imgFromPixels,
+    spriteFromImg,
     convertCvFrameToPyglet,
-    warpCameraImageToWholeScreen,
-    findHighestVisibleFingertipCandidate
+    selectInnerQuadPoints
 )
+from fingertip_tracker import FingertipTracker
+from vision_pipeline import PipelinedSheetDetector
+from telemetry import MetricsRegistry
 
 BIRD_RADIUS_PIXELS = 16
 PIPE_HORIZONTAL_SPEED = 155
@@ -24,58 +30,44 @@ SECONDS_BETWEEN_PIPE_SPAWNS = 2.8
 PIPE_MIN_Y_POS = 100
 PIPE_MAX_Y_POS = SCREEN_HEIGHT - 100
 
-FINGER_HISTORY_LENGTH = 8
 ARUCO_MARKER_ID_LIST = [0, 1, 2, 3]
 
-cameraDevice = cv2.VideoCapture(0)
-
-gameWindow = pyglet.window.Window(
-    SCREEN_WIDTH,
-    SCREEN_HEIGHT,
-    caption="AR-Flappy"
-)
-
-arucoDictionaryObject = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
-arucoDetectorObject = aruco.ArucoDetector(arucoDictionaryObject, aruco.DetectorParameters())
-
 assetsFolderPath = Path(__file__).parent
 
-birdSpriteFrameOne = loadImg(assetsFolderPath / "bird.png")
-birdSpriteFrameTwo = loadImg(assetsFolderPath / "bird2.png")
-
-pipeTextureImage = pyglet.image.load(str(assetsFolderPath / "pipe.png"))
-backgroundImageRaw = pyglet.image.load(str(assetsFolderPath / "background_image.png"))
-backgroundSprite = pyglet.sprite.Sprite(backgroundImageRaw)
-backgroundSprite.scale_x = SCREEN_WIDTH / backgroundSprite.width
-backgroundSprite.scale_y = SCREEN_HEIGHT / backgroundSprite.height
-
-scoreLabelText = pyglet.text.Label(
-    "0",
-    font_size=28,
-    x=10,
-    y=SCREEN_HEIGHT - 34,
-    anchor_x="left",
-    anchor_y="baseline"
-)
-
-gameOverLabelText = pyglet.text.Label(
-    "",
-    font_size=28,
-    x=SCREEN_WIDTH // 2,
-    y=SCREEN_HEIGHT // 2,
-    anchor_x="center",
-    anchor_y="center",
-    color=(255, 255, 255, 255)
-)
-
-standbyLabelText = pyglet.text.Label(
-    "Show the ArUco marker sheet to start (RIGHT WAY UP!)",
-    font_size=20,
-    x=SCREEN_WIDTH // 2,
-    y=35,
-    anchor_x="center",
-    anchor_y="baseline"
-)
+#created in main(), importing this file does not open the camera or a window
+cameraDevice = None
+gameWindow = None
+arucoDetectorObject = None
+birdSpriteFrameOne = None
+birdSpriteFrameTwo = None
+pipeTextureImage = None
+backgroundSprite = None
+scoreLabelText = None
+gameOverLabelText = None
+standbyLabelText = None
+
+#optional worker processes for marker detection, 0 = everything in this process
+pipelineWorkerCount = 0
+visionPipeline = None
+lastTrackerUpdateTime = None
+
+#collected all the time, only written to a file when main() gets a telemetry path
+gameMetrics = MetricsRegistry()
+framesCapturedCounter = gameMetrics.counter("frames_captured")
+framesProcessedCounter = gameMetrics.counter("frames_processed")
+framesMarkersLockedCounter = gameMetrics.counter("frames_markers_locked")
+framesDroppedCounter = gameMetrics.counter("frames_dropped")
+framesRenderedCounter = gameMetrics.counter("frames_rendered")
+fingertipAttemptsCounter = gameMetrics.counter("fingertip_attempts")
+fingertipHitsCounter = gameMetrics.counter("fingertip_hits")
+detectionTimeHistogram = gameMetrics.histogram("detection_ms")
+warpTimeHistogram = gameMetrics.histogram("warp_ms")
+pipelineLatencyHistogram = gameMetrics.histogram("pipeline_latency_ms")
+
+#seconds since main() was called
+startupTimings = {}
+mainStartedTime = None
+exitAfterFirstFrameFlag = False
 
 rawCameraFrameBgr = None
 
@@ -83,7 +75,7 @@ markersCurrentlyVisible = False
 markersVisibleLastFrame = False
 gameWasStartedOnce = False
 
-fingerPositionHistoryDeque = deque(maxlen=FINGER_HISTORY_LENGTH)
+fingertipTracker = FingertipTracker()
 
 currentBirdPositionTuple = (
     SCREEN_WIDTH // 4,
@@ -131,7 +123,6 @@ def resetWholeGameState():
     global pipeSpriteDeque
     global timeToNextPipeSpawn
     global currentBirdPositionTuple
-    global fingerPositionHistoryDeque
 
     currentScoreValue = 0
     playerIsDead = False
@@ -139,19 +130,23 @@ def resetWholeGameState():
     createNewPipePair()
     timeToNextPipeSpawn = time.time() + SECONDS_BETWEEN_PIPE_SPAWNS
     currentBirdPositionTuple = (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2)
-    fingerPositionHistoryDeque.clear()
+    fingertipTracker.reset()
 
 
-@gameWindow.event
 def on_key_press(pressedKeySymbol, _):
     global playerIsDead
     if pressedKeySymbol == pyglet.window.key.R and markersCurrentlyVisible:
         resetWholeGameState()
 
 
-@gameWindow.event
 def on_draw():
     gameWindow.clear()
+    framesRenderedCounter.inc()
+
+    if rawCameraFrameBgr is not None and "first_frame" not in startupTimings:
+        startupTimings["first_frame"] = time.perf_counter() - mainStartedTime
+        if exitAfterFirstFrameFlag:
+            pyglet.app.exit()
 
     if not markersCurrentlyVisible:
         standbyImage = convertCvFrameToPyglet(rawCameraFrameBgr)
@@ -190,16 +185,47 @@ def updateEveryFrame(deltaTimeSeconds):
     global currentScoreValue
     global playerIsDead
     global timeToNextPipeSpawn
+    global visionPipeline
+    global lastTrackerUpdateTime
 
     okFlag, cameraFrameOriginal = cameraDevice.read()
     if not okFlag:
+        framesDroppedCounter.inc()
         return
+    framesCapturedCounter.inc()
     rawCameraFrameBgr = cv2.resize(cameraFrameOriginal, (SCREEN_WIDTH, SCREEN_HEIGHT))
 
-    grayFrame = cv2.cvtColor(cameraFrameOriginal, cv2.COLOR_BGR2GRAY)
-    markerCorners, markerIds, _ = arucoDetectorObject.detectMarkers(grayFrame)
-
-    markersFoundNow = markerIds is not None and len(markerIds) == 4
+    sheetFrame = cameraFrameOriginal
+    innerFourPointsList = None
+    if pipelineWorkerCount > 0 and visionPipeline is None:
+        visionPipeline = PipelinedSheetDetector(cameraFrameOriginal.shape, ARUCO_MARKER_ID_LIST, pipelineWorkerCount)
+    #a pipeline whose workers kept crashing falls back to detecting in this process
+    usePipeline = visionPipeline is not None and not visionPipeline.broken
+    if usePipeline:
+        #detection of this frame runs in a worker, use the newest finished older frame instead
+        if not visionPipeline.submit(cameraFrameOriginal):
+            framesDroppedCounter.inc()
+        lostResultsBefore = visionPipeline.resultsStale + visionPipeline.resultsFailed
+        pipelineResult = visionPipeline.poll()
+        framesDroppedCounter.inc(visionPipeline.resultsStale + visionPipeline.resultsFailed - lostResultsBefore)
+        if pipelineResult is None:
+            markersFoundNow = markersCurrentlyVisible
+            sheetFrame = None
+        else:
+            markersFoundNow = pipelineResult.markersFound
+            sheetFrame = pipelineResult.frame
+            innerFourPointsList = pipelineResult.innerQuad
+            framesProcessedCounter.inc()
+            pipelineLatencyHistogram.observe(pipelineResult.latencySeconds * 1000)
+            detectionTimeHistogram.observe(pipelineResult.detectionSeconds * 1000)
+    else:
+        detectionStartTime = time.perf_counter()
+        grayFrame = cv2.cvtColor(cameraFrameOriginal, cv2.COLOR_BGR2GRAY)
+        markerCorners, markerIds, _ = arucoDetectorObject.detectMarkers(grayFrame)
+        detectionTimeHistogram.observe((time.perf_counter() - detectionStartTime) * 1000)
+        framesProcessedCounter.inc()
+
+        markersFoundNow = markerIds is not None and len(markerIds) == 4
 
     if markersFoundNow and not markersVisibleLastFrame:
         if not gameWasStartedOnce or playerIsDead:
@@ -211,59 +237,29 @@ def updateEveryFrame(deltaTimeSeconds):
 
     if not markersCurrentlyVisible:
         return
+    if sheetFrame is not None:
+        framesMarkersLockedCounter.inc()
 
-    fingertipPositionCandidate = None
+    fingertipPosition = None
     try:
-        idList = [int(x) for x in markerIds.flatten()]
-        markerDictionary = {}
-        for indexNumber in range(len(idList)):
-            markerDictionary[idList[indexNumber]] = markerCorners[indexNumber]
-
-        everySinglePoint = []
-        for mid in ARUCO_MARKER_ID_LIST:
-            for cornerPoint in markerDictionary[mid][0]:
-                everySinglePoint.append(cornerPoint)
-
-        sumX = 0.0
-        sumY = 0.0
-        for onePoint in everySinglePoint:
-            sumX += onePoint[0]
-            sumY += onePoint[1]
-        center_X = sumX / len(everySinglePoint)
-        center_Y = sumY / len(everySinglePoint)
-
-        innerFourPointsList = []
-        for mid in ARUCO_MARKER_ID_LIST:
-            candidateCorners = markerDictionary[mid][0]
-            chosenPoint = candidateCorners[0]
-            smallestDistance = float("inf")
-            for pt in candidateCorners:
-                deltaX = pt[0] - center_X
-                deltaY = pt[1] - center_Y
-                distanceValue = math.sqrt(deltaX * deltaX + deltaY * deltaY)
-                if distanceValue < smallestDistance:
-                    smallestDistance = distanceValue
-                    chosenPoint = pt
-            innerFourPointsList.append(chosenPoint)
-
-        warpedCameraView = warpCameraImageToWholeScreen(cameraFrameOriginal, innerFourPointsList)
-        fingertipPositionCandidate = findHighestVisibleFingertipCandidate(warpedCameraView)
+        if not usePipeline:
+            innerFourPointsList = selectInnerQuadPoints(markerCorners, markerIds, ARUCO_MARKER_ID_LIST)
+        if sheetFrame is not None and innerFourPointsList is not None:
+            currentTime = time.perf_counter()
+            trackerDeltaTime = deltaTimeSeconds if lastTrackerUpdateTime is None else currentTime - lastTrackerUpdateTime
+            lastTrackerUpdateTime = currentTime
+            #tracker only warps and searches a window around the predicted fingertip, already filtered
+            fingertipPosition = fingertipTracker.update(sheetFrame, innerFourPointsList, trackerDeltaTime)
+            warpTimeHistogram.observe(fingertipTracker.lastWarpSeconds * 1000)
+            fingertipAttemptsCounter.inc()
+            if fingertipTracker.framesWithoutFinger == 0 and fingertipPosition is not None:
+                fingertipHitsCounter.inc()
 
     except:
-        fingertipPositionCandidate = None
-
-    if fingertipPositionCandidate:
-        fingerPositionHistoryDeque.append(fingertipPositionCandidate)
+        fingertipPosition = None
 
-    if fingerPositionHistoryDeque: #average finger pos to remove jumps
-        sumX = 0
-        sumY = 0
-        for xVal, yVal in fingerPositionHistoryDeque:
-            sumX += xVal
-            sumY += yVal
-        smoothX = int(sumX / len(fingerPositionHistoryDeque))
-        smoothY = int(sumY / len(fingerPositionHistoryDeque))
-        currentBirdPositionTuple = (smoothX, smoothY)
+    if fingertipPosition:
+        currentBirdPositionTuple = fingertipPosition
 
     bx, by = currentBirdPositionTuple
     if bx < BIRD_RADIUS_PIXELS:
@@ -321,5 +317,114 @@ def updateEveryFrame(deltaTimeSeconds):
         playerIsDead = True
 
 
-pyglet.clock.schedule_interval(updateEveryFrame, 1 / 120)
-pyglet.app.run()
+def createLabels():
+    global scoreLabelText
+    global gameOverLabelText
+    global standbyLabelText
+
+    scoreLabelText = pyglet.text.Label(
+        "0",
+        font_size=28,
+        x=10,
+        y=SCREEN_HEIGHT - 34,
+        anchor_x="left",
+        anchor_y="baseline"
+    )
+
+    gameOverLabelText = pyglet.text.Label(
+        "",
+        font_size=28,
+        x=SCREEN_WIDTH // 2,
+        y=SCREEN_HEIGHT // 2,
+        anchor_x="center",
+        anchor_y="center",
+        color=(255, 255, 255, 255)
+    )
+
+    standbyLabelText = pyglet.text.Label(
+        "Show the ArUco marker sheet to start (RIGHT WAY UP!)",
+        font_size=20,
+        x=SCREEN_WIDTH // 2,
+        y=35,
+        anchor_x="center",
+        anchor_y="baseline"
+    )
+
+
+def main(exitAfterFirstFrame=False, pipelineWorkers=0, telemetryPath=None, telemetryIntervalSeconds=10.0):
+    global cameraDevice
+    global gameWindow
+    global arucoDetectorObject
+    global birdSpriteFrameOne
+    global birdSpriteFrameTwo
+    global pipeTextureImage
+    global backgroundSprite
+    global mainStartedTime
+    global exitAfterFirstFrameFlag
+    global pipelineWorkerCount
+
+    pipelineWorkerCount = pipelineWorkers
+    mainStartedTime = time.perf_counter()
+    exitAfterFirstFrameFlag = exitAfterFirstFrame
+
+    #camera warms up and images are decoded in the background while the window and labels are created
+    with ThreadPoolExecutor(max_workers=4) as workerPool:
+        #opening the camera needs no gl, it can start before the window
+        cameraFuture = workerPool.submit(openCameraDevice, 0)
+
+        #the window (and with it pyglet's gl context) has to be created on the main thread
+        gameWindow = pyglet.window.Window(
+            SCREEN_WIDTH,
+            SCREEN_HEIGHT,
+            caption="AR-Flappy"
+        )
+        gameWindow.push_handlers(on_key_press, on_draw)
+
+        birdOneFuture = workerPool.submit(decodeImgPixels, assetsFolderPath / "bird.png")
+        birdTwoFuture = workerPool.submit(decodeImgPixels, assetsFolderPath / "bird2.png")
+        pipeFuture = workerPool.submit(decodeImgPixels, assetsFolderPath / "pipe.png")
+        backgroundFuture = workerPool.submit(decodeImgPixels, assetsFolderPath / "background_image.png")
+
+        arucoDictionaryObject = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
+        arucoDetectorObject = aruco.ArucoDetector(arucoDictionaryObject, aruco.DetectorParameters())
+
+        createLabels()
+
+        birdSpriteFrameOne = spriteFromImg(imgFromPixels(birdOneFuture.result()))
+        birdSpriteFrameTwo = spriteFromImg(imgFromPixels(birdTwoFuture.result()))
+        pipeTextureImage = imgFromPixels(pipeFuture.result())
+        backgroundSprite = pyglet.sprite.Sprite(imgFromPixels(backgroundFuture.result()))
+        backgroundSprite.scale_x = SCREEN_WIDTH / backgroundSprite.width
+        backgroundSprite.scale_y = SCREEN_HEIGHT / backgroundSprite.height
+        startupTimings["assets_ready"] = time.perf_counter() - mainStartedTime
+
+        cameraDevice = cameraFuture.result()
+        startupTimings["camera_ready"] = time.perf_counter() - mainStartedTime
+
+    pyglet.clock.schedule_interval(updateEveryFrame, 1 / 120)
+    if telemetryPath:
+        gameMetrics.start(telemetryPath, telemetryIntervalSeconds)
+
+    #the worker pool and the shared memory segment must not outlive a crashed game loop
+    try:
+        pyglet.app.run()
+    finally:
+        gameMetrics.stop()
+        cameraDevice.release()
+        if visionPipeline is not None:
+            print("vision pipeline:", visionPipeline.stats())
+            visionPipeline.close()
+    return startupTimings
+
+
+if __name__ == "__main__":
+    argumentParser = argparse.ArgumentParser()
+    argumentParser.add_argument("--pipeline-workers", type=int, default=0,
+                                help="detect markers in this many worker processes (for fast cameras with many cores)")
+    argumentParser.add_argument("--telemetry", metavar="FILE",
+                                help="append game and vision metrics as JSON lines to this (rotating) file")
+    argumentParser.add_argument("--telemetry-interval", type=float, default=10.0,
+                                help="seconds between two telemetry lines")
+    arguments = argumentParser.parse_args()
+    main(pipelineWorkers=arguments.pipeline_workers, telemetryPath=arguments.telemetry,
+         telemetryIntervalSeconds=arguments.telemetry_interval)
@@ -0,0 +1,160 @@
+import time
+
+import cv2
+import numpy as np
+
+from helpers import SCREEN_WIDTH, SCREEN_HEIGHT, TARGET_CORNERS
+
+SEARCH_WINDOW_WIDTH = 360
+SEARCH_WINDOW_HEIGHT = 360
+FRAMES_UNTIL_LOST = 4
+MIN_FINGER_AREA = 500
+
+#alpha-beta filter: how much of the measurement error goes into position / velocity
+FILTER_ALPHA = 0.6
+FILTER_BETA = 0.2
+
+#measurements further away from the prediction are treated as a miss (px, per frame without finger it grows by the step)
+GATE_DISTANCE = 120
+GATE_DISTANCE_STEP = 60
+#background pixels not seen for more frames are learned again before they are used for segmentation
+BACKGROUND_MAX_AGE = 30
+
+
+def segmentHighestPoint(gray_frame, background_model, stale_mask=None):
+    #same segmentation as findHighestVisibleFingertipCandidate, but on a (cropped) view of the background model
+    if stale_mask is not None:
+        #outdated background would show every change since it was learned as movement
+        np.copyto(background_model, gray_frame, where=stale_mask)
+    cv2.accumulateWeighted(gray_frame, background_model, 0.4)
+
+    background8u = cv2.convertScaleAbs(background_model)
+    movementMask = cv2.absdiff(gray_frame, background8u)
+
+    _, movementMask = cv2.threshold(movementMask, 25, 255, cv2.THRESH_BINARY)
+    movementMask = cv2.dilate(movementMask, None, iterations=2)
+
+    contours, _ = cv2.findContours(movementMask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) == 0:
+        return None
+
+    biggestContour = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(biggestContour) < MIN_FINGER_AREA:
+        return None
+
+    highestPointIndex = biggestContour[:, :, 1].argmin()
+    x, y = biggestContour[highestPointIndex][0]
+    return (int(x), int(y))
+
+
+class FingertipTracker:
+    '''Tracks the fingertip in screen coordinates of the warped marker sheet.
+
+    While the finger is tracked, only a search window around the predicted position is warped
+    and segmented. When the finger was not found for a few frames it counts as lost and the whole
+    sheet is scanned again. The position is smoothed with an alpha-beta filter, which also gives the
+    velocity for the prediction; measurements far away from the prediction are ignored.
+    The background is only updated inside the window, so every pixel remembers the frame it was last
+    learned in and pixels older than BACKGROUND_MAX_AGE are learned again before they are compared.
+    '''
+
+    def __init__(self):
+        self.backgroundModel = None
+        self.backgroundLearnedFrame = None
+        self.frameIndex = 0
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.framesWithoutFinger = 0
+        self.lastWarpSeconds = 0.0
+
+    @property
+    def isTracking(self):
+        return self.position is not None and self.framesWithoutFinger < FRAMES_UNTIL_LOST
+
+    def reset(self):
+        self.backgroundModel = None
+        self.backgroundLearnedFrame = None
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.framesWithoutFinger = 0
+
+    def predict(self, delta_time):
+        #the fingertip can't leave the sheet, stop the velocity at the border instead of coasting off screen
+        predictedPosition = self.position + self.velocity * delta_time
+        clampedPosition = np.clip(predictedPosition, (0, 0), (SCREEN_WIDTH - 1, SCREEN_HEIGHT - 1))
+        self.velocity[clampedPosition != predictedPosition] = 0
+        return clampedPosition
+
+    def lose(self):
+        self.position = None
+        self.velocity = np.zeros(2)
+
+    def searchWindow(self, predicted_position):
+        x0 = int(predicted_position[0]) - SEARCH_WINDOW_WIDTH // 2
+        y0 = int(predicted_position[1]) - SEARCH_WINDOW_HEIGHT // 3 #finger comes from below, look more below the tip
+        x0 = min(max(x0, 0), SCREEN_WIDTH - SEARCH_WINDOW_WIDTH)
+        y0 = min(max(y0, 0), SCREEN_HEIGHT - SEARCH_WINDOW_HEIGHT)
+        return x0, y0, SEARCH_WINDOW_WIDTH, SEARCH_WINDOW_HEIGHT
+
+    def update(self, source_bgr, source_points, delta_time):
+        '''Returns the filtered fingertip position as (x, y) or None while the finger is lost.'''
+        sheetMatrix = cv2.getPerspectiveTransform(np.array(source_points, dtype=np.float32), TARGET_CORNERS)
+
+        if self.isTracking:
+            predictedPosition = self.predict(delta_time)
+            x0, y0, w, h = self.searchWindow(predictedPosition)
+        else:
+            predictedPosition = None
+            x0, y0, w, h = 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT
+
+        #warp only the search window: shift the sheet transformation by the window offset
+        windowMatrix = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64) @ sheetMatrix
+        warpStartTime = time.perf_counter()
+        warpedWindow = cv2.warpPerspective(source_bgr, windowMatrix, (w, h))
+        self.lastWarpSeconds = time.perf_counter() - warpStartTime
+        grayWindow = cv2.cvtColor(warpedWindow, cv2.COLOR_BGR2GRAY)
+
+        self.frameIndex += 1
+        if self.backgroundModel is None:
+            self.backgroundModel = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH), dtype="float")
+            self.backgroundModel[y0:y0 + h, x0:x0 + w] = grayWindow
+            self.backgroundLearnedFrame = np.full((SCREEN_HEIGHT, SCREEN_WIDTH), -BACKGROUND_MAX_AGE - 1, dtype=np.int32)
+            self.backgroundLearnedFrame[y0:y0 + h, x0:x0 + w] = self.frameIndex
+            return self.currentPosition()
+
+        learnedFrameWindow = self.backgroundLearnedFrame[y0:y0 + h, x0:x0 + w]
+        staleMask = learnedFrameWindow < self.frameIndex - BACKGROUND_MAX_AGE
+        measurement = segmentHighestPoint(grayWindow, self.backgroundModel[y0:y0 + h, x0:x0 + w],
+                                          staleMask if staleMask.any() else None)
+        learnedFrameWindow[:] = self.frameIndex
+
+        measuredPosition = None
+        if measurement is not None:
+            measuredPosition = np.array((measurement[0] + x0, measurement[1] + y0), dtype=float)
+            gateDistance = GATE_DISTANCE + GATE_DISTANCE_STEP * self.framesWithoutFinger
+            if predictedPosition is not None and np.linalg.norm(measuredPosition - predictedPosition) > gateDistance:
+                measuredPosition = None #too far from the prediction, most likely some other movement
+
+        if measuredPosition is None:
+            self.framesWithoutFinger += 1
+            if self.framesWithoutFinger >= FRAMES_UNTIL_LOST:
+                self.lose() #no confidence left, don't report a made up position
+            elif predictedPosition is not None:
+                self.position = predictedPosition #coast along the prediction for a few frames
+            return self.currentPosition()
+
+        if predictedPosition is None:
+            self.position = measuredPosition
+            self.velocity = np.zeros(2)
+        else:
+            residual = measuredPosition - predictedPosition
+            self.position = predictedPosition + FILTER_ALPHA * residual
+            if delta_time > 0:
+                self.velocity = self.velocity + FILTER_BETA * residual / delta_time
+        self.framesWithoutFinger = 0
+        return self.currentPosition()
+
+    def currentPosition(self):
+        if self.position is None:
+            return None
+        return (int(self.position[0]), int(self.position[1]))
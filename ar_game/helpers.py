@@ -1,3 +1,5 @@
+import math
+
 import cv2
 import numpy as np
 import pyglet
@@ -14,8 +16,27 @@ TARGET_CORNERS = np.array(
      [0, SCREEN_HEIGHT - 1]], dtype="float32"
 )
 
-def loadImg(image_path: Path):
-    picture = pyglet.image.load(str(image_path))
+def openCameraDevice(device_id=0):
+    cameraDevice = cv2.VideoCapture(device_id)
+    cameraDevice.read() #first read is slow, do it while the rest is loading
+    return cameraDevice
+
+
+def decodeImgPixels(image_path: Path):
+    #decoded with PIL and not pyglet.image, the first use of pyglet.image creates a gl context
+    #which must happen on the main thread -> this one can run in a worker thread
+    with Image.open(image_path) as picture:
+        rgbaPicture = picture.convert("RGBA")
+        return rgbaPicture.width, rgbaPicture.height, rgbaPicture.tobytes()
+
+
+def imgFromPixels(pixels):
+    #main thread only
+    widthPixels, heightPixels, rawBytes = pixels
+    return pyglet.image.ImageData(widthPixels, heightPixels, "RGBA", rawBytes, pitch=-widthPixels * 4)
+
+
+def spriteFromImg(picture):
     picture.anchor_x = picture.width // 2
     picture.anchor_y = picture.height // 2
     spriteObject = pyglet.sprite.Sprite(picture)
@@ -27,7 +48,7 @@ def convertCvFrameToPyglet(frame_bgr):
         return None
     heightPixels = frame_bgr.shape[0]
     widthPixels = frame_bgr.shape[1]
-    rawBytes = Image.fromarray(frame_bgr).tobytes()
+    rawBytes = frame_bgr.tobytes()
     return pyglet.image.ImageData(
         widthPixels,
         heightPixels,
@@ -49,6 +70,42 @@ def warpCameraImageToWholeScreen(source_bgr, source_points):
     )
     return warpedImage
 
+def selectInnerQuadPoints(marker_corners, marker_ids, marker_id_list):
+    #for each marker take the corner closest to the center of all markers -> inner corners of the sheet
+    idList = [int(x) for x in marker_ids.flatten()]
+    markerDictionary = {}
+    for indexNumber in range(len(idList)):
+        markerDictionary[idList[indexNumber]] = marker_corners[indexNumber]
+
+    everySinglePoint = []
+    for mid in marker_id_list:
+        for cornerPoint in markerDictionary[mid][0]:
+            everySinglePoint.append(cornerPoint)
+
+    sumX = 0.0
+    sumY = 0.0
+    for onePoint in everySinglePoint:
+        sumX += onePoint[0]
+        sumY += onePoint[1]
+    center_X = sumX / len(everySinglePoint)
+    center_Y = sumY / len(everySinglePoint)
+
+    innerFourPointsList = []
+    for mid in marker_id_list:
+        candidateCorners = markerDictionary[mid][0]
+        chosenPoint = candidateCorners[0]
+        smallestDistance = float("inf")
+        for pt in candidateCorners:
+            deltaX = pt[0] - center_X
+            deltaY = pt[1] - center_Y
+            distanceValue = math.sqrt(deltaX * deltaX + deltaY * deltaY)
+            if distanceValue < smallestDistance:
+                smallestDistance = distanceValue
+                chosenPoint = pt
+        innerFourPointsList.append(chosenPoint)
+    return innerFourPointsList
+
+
 def findHighestVisibleFingertipCandidate(image_bgr):
     grayFrame = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
 
@@ -0,0 +1,223 @@
+import gc
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+
+#upper bucket edges in ms, the last bucket takes everything above
+DEFAULT_BUCKETS_MS = [0.5, 1, 2, 4, 6, 8, 10, 12, 16, 20, 25, 33, 50, 75, 100, 200, 500]
+
+#derived per interval values: (name, numerator counter, denominator counter)
+RATIOS = [
+    ("marker_lock_ratio", "frames_markers_locked", "frames_processed"),
+    ("fingertip_hit_rate", "fingertip_hits", "fingertip_attempts"),
+]
+#(name, counter), counter per second
+RATES = [
+    ("render_fps", "frames_rendered"),
+    ("camera_fps", "frames_captured"),
+]
+
+
+class Counter:
+    #a plain int attribute, incrementing it costs about as much as the game's own score counter
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    '''Fixed buckets, preallocated when created, observe() does not allocate.
+
+    observe() runs on the game thread and snapshot() on the flush thread. Only observe() writes the
+    maxima, snapshot() just starts a new interval by counting up intervalIndex, the first observe()
+    in the new interval then replaces the interval maximum instead of comparing against it.
+    '''
+    __slots__ = ("edges", "counts", "count", "total", "maximum",
+                 "intervalMaximum", "intervalIndex", "observedIntervalIndex")
+
+    def __init__(self, edges=None):
+        self.edges = list(edges or DEFAULT_BUCKETS_MS)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.intervalMaximum = 0.0
+        self.intervalIndex = 0
+        self.observedIntervalIndex = 0
+
+    def observe(self, value):
+        self.counts[bisect_right(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+        if self.observedIntervalIndex != self.intervalIndex:
+            self.observedIntervalIndex = self.intervalIndex
+            self.intervalMaximum = value
+        elif value > self.intervalMaximum:
+            self.intervalMaximum = value
+
+    def snapshot(self):
+        #maximum since the previous snapshot, 0 if nothing was observed since then
+        intervalMaximum = self.intervalMaximum if self.observedIntervalIndex == self.intervalIndex else 0.0
+        self.intervalIndex += 1
+        return (list(self.counts), self.count, self.total, intervalMaximum)
+
+
+def summarizeHistogram(edges, counts, count, total, maximum):
+    summary = {"count": count, "mean": total / count if count else None, "max": maximum if count else None}
+    for name, quantile in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        summary[name] = None
+        if count:
+            target = quantile * count
+            seen = 0
+            for index, bucketCount in enumerate(counts):
+                seen += bucketCount
+                if seen >= target:
+                    #upper edge of the bucket, the overflow bucket reports the maximum
+                    summary[name] = edges[index] if index < len(edges) else maximum
+                    break
+    return summary
+
+
+def readRssBytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as statmFile:
+            return int(statmFile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxRss if sys.platform == "darwin" else maxRss * 1024 #peak, not current
+    except ImportError:
+        return None
+
+
+class MetricsRegistry:
+    '''Counters and histograms for the hot path plus a background thread that writes them to a file.
+
+    Collecting is always on and only touches preallocated objects. start() installs the gc hook and
+    starts the flush thread, which appends one JSON line per interval to a rotating log file.
+    Every line holds the values of the last interval and the totals since start.
+    Counters and histograms have a single writer, the game thread that calls start(). Collections
+    running on other threads (flush thread, thread pools) are not recorded in gc_pause_ms.
+    '''
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.startTime = time.time()
+        self.flushThread = None
+        self.stopEvent = threading.Event()
+        self.fileLogger = None
+        self.previousCounters = {}
+        self.previousHistograms = {}
+        self.previousFlushTime = time.perf_counter()
+        self.gcStartTime = None
+        self.gcPauses = self.histogram("gc_pause_ms")
+        self.gameThreadId = threading.get_ident()
+
+    def counter(self, name):
+        if name not in self.counters:
+            self.counters[name] = Counter()
+        return self.counters[name]
+
+    def histogram(self, name, edges=None):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(edges)
+        return self.histograms[name]
+
+    def gcCallback(self, phase, info):
+        if threading.get_ident() != self.gameThreadId:
+            return
+        if phase == "start":
+            self.gcStartTime = time.perf_counter()
+        elif self.gcStartTime is not None:
+            self.gcPauses.observe((time.perf_counter() - self.gcStartTime) * 1000)
+            self.gcStartTime = None
+
+    def start(self, file_path, interval_seconds=10.0, max_bytes=5 * 1024 * 1024, backup_count=5):
+        handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.fileLogger = logging.getLogger(f"telemetry.{id(self)}")
+        self.fileLogger.propagate = False
+        self.fileLogger.setLevel(logging.INFO)
+        self.fileLogger.addHandler(handler)
+
+        self.gameThreadId = threading.get_ident()
+        gc.callbacks.append(self.gcCallback)
+        self.previousFlushTime = time.perf_counter()
+        self.flushThread = threading.Thread(target=self.flushLoop, args=(interval_seconds,),
+                                            name="telemetry-flush", daemon=True)
+        self.flushThread.start()
+
+    def flushLoop(self, interval_seconds):
+        while not self.stopEvent.wait(interval_seconds):
+            self.flush()
+
+    def collect(self):
+        '''Interval and total values since the last call, derived values are added by the caller.'''
+        now = time.perf_counter()
+        intervalSeconds = now - self.previousFlushTime
+        self.previousFlushTime = now
+
+        record = {"time": time.time(), "uptime_s": time.time() - self.startTime, "interval_s": intervalSeconds}
+        for name, counter in list(self.counters.items()):
+            value = counter.value
+            record[name] = value - self.previousCounters.get(name, 0)
+            record[name + "_total"] = value
+            self.previousCounters[name] = value
+
+        for name, histogram in list(self.histograms.items()):
+            counts, count, total, maximum = histogram.snapshot()
+            previousCounts, previousCount, previousTotal = self.previousHistograms.get(
+                name, ([0] * len(counts), 0, 0.0))
+            intervalCounts = [a - b for a, b in zip(counts, previousCounts)]
+            record[name] = summarizeHistogram(histogram.edges, intervalCounts, count - previousCount,
+                                              total - previousTotal, maximum)
+            record[name]["max_total"] = histogram.maximum if count else None
+            self.previousHistograms[name] = (counts, count, total)
+
+        record["rss_bytes"] = readRssBytes()
+        return record
+
+    def flush(self):
+        record = self.collect()
+        for ratioName, numerator, denominator in RATIOS:
+            if numerator in record and denominator in record:
+                record[ratioName] = record[numerator] / record[denominator] if record[denominator] else None
+        for rateName, counterName in RATES:
+            if counterName in record and record["interval_s"] > 0:
+                record[rateName] = record[counterName] / record["interval_s"]
+        if self.fileLogger is not None:
+            self.fileLogger.info(json.dumps(record))
+        return record
+
+    def stop(self):
+        if self.flushThread is None:
+            return
+        self.stopEvent.set()
+        self.flushThread.join()
+        self.flushThread = None
+        if self.gcCallback in gc.callbacks:
+            gc.callbacks.remove(self.gcCallback)
+        self.flush()
+        for handler in list(self.fileLogger.handlers):
+            handler.close()
+            self.fileLogger.removeHandler(handler)
+
@@ -0,0 +1,216 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+from helpers import selectInnerQuadPoints
+
+#frames waiting for or in a worker per worker, more slots = more throughput but more latency
+SLOTS_PER_WORKER = 2
+#a crashed worker breaks the whole pool, it is recreated this often before the detector gives up
+MAX_POOL_RESTARTS = 3
+
+#state of a worker process, set by initWorker
+workerFrames = None
+workerSharedMemory = None
+workerDetector = None
+workerMarkerIds = None
+
+
+def initWorker(shared_memory_name, frames_shape, marker_id_list):
+    global workerFrames
+    global workerSharedMemory
+    global workerDetector
+    global workerMarkerIds
+
+    workerSharedMemory = shared_memory.SharedMemory(name=shared_memory_name)
+    workerFrames = np.ndarray(frames_shape, dtype=np.uint8, buffer=workerSharedMemory.buf)
+    arucoDictionaryObject = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
+    workerDetector = aruco.ArucoDetector(arucoDictionaryObject, aruco.DetectorParameters())
+    workerMarkerIds = marker_id_list
+    cv2.setNumThreads(1) #parallelism comes from the processes, avoid oversubscribing the cores
+
+
+def detectSheetInSlot(slot_index):
+    #stateless part of the vision chain: gray -> detectMarkers -> inner quad, only small results go back
+    detectionStartTime = time.perf_counter()
+    grayFrame = cv2.cvtColor(workerFrames[slot_index], cv2.COLOR_BGR2GRAY)
+    markerCorners, markerIds, _ = workerDetector.detectMarkers(grayFrame)
+
+    markersFound = markerIds is not None and len(markerIds) == len(workerMarkerIds)
+    innerQuad = None
+    if markersFound:
+        try:
+            innerQuad = [(float(x), float(y)) for x, y in selectInnerQuadPoints(markerCorners, markerIds, workerMarkerIds)]
+        except KeyError:
+            innerQuad = None
+    return markersFound, innerQuad, time.perf_counter() - detectionStartTime
+
+
+class PipelineResult:
+    def __init__(self, frame_index, frame, markers_found, inner_quad, latency_seconds, detection_seconds):
+        self.frameIndex = frame_index
+        self.frame = frame
+        self.markersFound = markers_found
+        self.innerQuad = inner_quad
+        self.latencySeconds = latency_seconds
+        self.detectionSeconds = detection_seconds #measured in the worker, without queueing and transfer
+
+
+class PipelinedSheetDetector:
+    '''Detects the marker sheet of consecutive frames concurrently in worker processes.
+
+    Frames are copied into a ring of shared memory slots instead of being pickled. When all slots
+    are busy the new frame is dropped, which keeps the added latency bounded. Results come back in
+    frame order; if several are ready at once only the newest is returned and the older ones are
+    dropped as stale. The motion segmentation stays in the main process because it needs the
+    previous frames.
+
+    A frame whose detection fails is counted as failed. When a worker dies, the pool is recreated
+    with the frames in flight counted as failed; after MAX_POOL_RESTARTS the detector is marked as
+    broken and the caller has to detect in its own process.
+    '''
+
+    def __init__(self, frame_shape, marker_id_list, workers=2):
+        self.slotCount = workers * SLOTS_PER_WORKER
+        framesShape = (self.slotCount,) + tuple(frame_shape)
+        self.sharedMemory = shared_memory.SharedMemory(create=True, size=int(np.prod(framesShape)))
+        self.frames = np.ndarray(framesShape, dtype=np.uint8, buffer=self.sharedMemory.buf)
+        self.workerCount = workers
+        self.workerInitArgs = (self.sharedMemory.name, framesShape, list(marker_id_list))
+        self.executor = self.createExecutor()
+        self.poolRestarts = 0
+        self.broken = False
+
+        self.freeSlots = list(range(self.slotCount))
+        self.pending = {} #frame index -> (future, slot, submit time)
+        self.heldSlot = None #slot of the last returned result, its frame is still in use
+        self.nextFrameIndex = 0
+
+        self.framesSubmitted = 0
+        self.framesDropped = 0
+        self.resultsDelivered = 0
+        self.resultsStale = 0
+        self.resultsFailed = 0
+        self.lastLatencySeconds = 0.0
+        self.maxLatencySeconds = 0.0
+        self.latencySumSeconds = 0.0
+
+    def createExecutor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workerCount,
+            initializer=initWorker,
+            initargs=self.workerInitArgs
+        )
+
+    def restartExecutor(self):
+        #every frame in flight is lost with the old pool
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for future, slot, submitTime in self.pending.values():
+            self.freeSlots.append(slot)
+            self.resultsFailed += 1
+        self.pending.clear()
+        if self.poolRestarts >= MAX_POOL_RESTARTS:
+            self.broken = True
+            return
+        self.poolRestarts += 1
+        self.executor = self.createExecutor()
+
+    def submit(self, frame_bgr):
+        if frame_bgr.shape != self.frames.shape[1:]:
+            raise ValueError(f"frame shape {frame_bgr.shape} does not match {self.frames.shape[1:]}")
+        if self.broken or not self.freeSlots:
+            self.framesDropped += 1
+            return False
+        slot = self.freeSlots.pop()
+        np.copyto(self.frames[slot], frame_bgr)
+        try:
+            future = self.executor.submit(detectSheetInSlot, slot)
+        except (BrokenProcessPool, RuntimeError):
+            self.freeSlots.append(slot)
+            self.framesDropped += 1
+            self.restartExecutor()
+            return False
+        self.pending[self.nextFrameIndex] = (future, slot, time.perf_counter())
+        self.nextFrameIndex += 1
+        self.framesSubmitted += 1
+        return True
+
+    def poll(self):
+        '''Returns the newest finished result in frame order, or None if nothing new is ready.
+
+        The frame of the returned result stays valid until the next call of poll().
+        '''
+        if self.heldSlot is not None:
+            self.freeSlots.append(self.heldSlot)
+            self.heldSlot = None
+
+        ready = []
+        for frameIndex in sorted(self.pending):
+            future, slot, submitTime = self.pending[frameIndex]
+            if not future.done():
+                break #keep the order, later frames wait for this one
+            ready.append((frameIndex, future, slot, submitTime))
+            del self.pending[frameIndex]
+
+        if not ready:
+            return None
+
+        poolBroken = False
+        for frameIndex, future, slot, submitTime in ready[:-1]:
+            self.freeSlots.append(slot)
+            #only finished detections are stale, failed ones are counted as failed
+            error = None if future.cancelled() else future.exception()
+            if future.cancelled() or error is not None:
+                self.resultsFailed += 1
+                poolBroken = poolBroken or isinstance(error, BrokenProcessPool)
+            else:
+                self.resultsStale += 1
+
+        frameIndex, future, slot, submitTime = ready[-1]
+        result = None
+        try:
+            markersFound, innerQuad, detectionSeconds = future.result()
+        except BrokenProcessPool:
+            poolBroken = True
+        except Exception:
+            pass
+        else:
+            latency = time.perf_counter() - submitTime
+            self.lastLatencySeconds = latency
+            self.maxLatencySeconds = max(self.maxLatencySeconds, latency)
+            self.latencySumSeconds += latency
+            self.resultsDelivered += 1
+            self.heldSlot = slot
+            result = PipelineResult(frameIndex, self.frames[slot], markersFound, innerQuad, latency, detectionSeconds)
+
+        if result is None:
+            self.freeSlots.append(slot)
+            self.resultsFailed += 1
+        if poolBroken:
+            self.restartExecutor()
+        return result
+
+    def stats(self):
+        return {
+            "submitted": self.framesSubmitted,
+            "dropped": self.framesDropped,
+            "delivered": self.resultsDelivered,
+            "stale": self.resultsStale,
+            "failed": self.resultsFailed,
+            "pool_restarts": self.poolRestarts,
+            "broken": self.broken,
+            "last_latency_ms": self.lastLatencySeconds * 1000,
+            "mean_latency_ms": self.latencySumSeconds * 1000 / max(1, self.resultsDelivered),
+            "max_latency_ms": self.maxLatencySeconds * 1000,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.frames = None
+        self.sharedMemory.close()
+        self.sharedMemory.unlink()
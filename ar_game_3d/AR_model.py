@@ -1,11 +1,43 @@
 import pyglet
-from pyglet.gl import *
 from pyglet.math import Mat4, Vec3
 import math
+from functools import lru_cache
+
+import numpy as np
+
+# models whose marker was not seen for longer than this are hidden (seconds)
+MARKER_TIMEOUT = 0.5
+
+
+@lru_cache(maxsize=None)
+def load_scene(path):
+    # parsing the OBJ itself needs no GL, but importing pyglet.model imports pyglet.gl which creates
+    # pyglet's shadow window; only call this from a worker after that happened on the main thread.
+    # models using the same file share the parsed scene
+    return pyglet.model.load(path)
+
+
+@lru_cache(maxsize=None)
+def load_bounds(path):
+    # corners of the axis aligned bounding box of all meshes, homogeneous model coordinates (8x4)
+    positions = []
+    for node in load_scene(path).nodes:
+        for mesh in node.meshes:
+            for primitive in mesh.primitives:
+                for attribute in primitive.attributes:
+                    if attribute.name == "POSITION":
+                        positions.append(np.asarray(attribute.array, dtype=np.float32).reshape(-1, 3))
+    points = np.concatenate(positions)
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    corners = np.ones((8, 4), dtype=np.float32)
+    for index in range(8):
+        corners[index, :3] = [hi[axis] if index >> axis & 1 else lo[axis] for axis in range(3)]
+    return corners
 
 
 class Model:
-    def __init__(self, path, id, win_h, win_w, rot_x=0, rot_y=0, rot_z=0, scaling_factor=1):
+    def __init__(self, path, id, win_h, win_w, rot_x=0, rot_y=0, rot_z=0, scaling_factor=1, batch=None, group=None):
         self._id = id
         self._win_h = win_h
         self._win_w = win_w
@@ -17,8 +49,41 @@ class Model:
         self._position = None
         self._view_matrix = None
         self._length = None
-        self.batch = pyglet.graphics.Batch()
-        self._model = pyglet.model.load(path).create_models(batch=self.batch)[0]
+        self._last_seen = 0.0
+        self._hit_until = 0.0
+        self._yaw = 0.0
+        self.batch = batch if batch is not None else pyglet.graphics.Batch()
+        # models of the same OBJ share material and shader, without a parent group of their own their
+        # material groups would compare equal and the batch would draw all of them with one matrix
+        self.group = group if group is not None else pyglet.graphics.Group()
+        self._model = load_scene(path).create_models(batch=self.batch, group=self.group)[0]
+        self._bounds = load_bounds(path)
+
+    @property
+    def id(self):
+        return self._id
+
+    def move_to_batch(self, batch):
+        # pyglet migrates the vertex lists with their own groups, so this is only done when visibility changes
+        if batch is not self.batch:
+            self.batch = batch
+            self._model.batch = batch
+
+    def is_on_screen(self, view, projection):
+        # project the bounding box with the current model matrix and test it against the view volume
+        if self._position is None:
+            return False
+        # pyglet matrices are column major, so the reshaped tuple is the transpose: row vector @ it
+        mvp = np.array(tuple(projection @ view @ self._model.matrix), dtype=np.float32).reshape(4, 4)
+        clip = self._bounds @ mvp
+        w = clip[:, 3]
+        if (w <= 0).any():
+            # a corner is behind the camera, the projection is not reliable, better draw it
+            return True
+        ndc = clip[:, :3] / w[:, None]
+        lo = ndc.min(axis=0)
+        hi = ndc.max(axis=0)
+        return bool((lo[:2] <= 1).all() and (hi[:2] >= -1).all() and lo[2] <= 1 and hi[2] >= -1)
 
 
     def setup_translation(self, marker_id, view_matrix, position, length):
@@ -29,6 +94,8 @@ class Model:
 
 
     def animate(self):
+        if self._view_matrix is None or self._position is None:
+            return
         try:
             # translation matrix to set the position of the 3D model within the window
             trans = Mat4.from_translation(Vec3(
@@ -55,4 +122,63 @@ class Model:
             self._model.matrix = trans @ rot @ rot_x @ rot_z @ rot_y @ scale        
         except:
             pass
-        
\ No newline at end of file
+
+
+class SceneManager:
+    '''Keeps track of which models are live (marker seen recently) and draws the visible ones in one batch.
+
+    All models share two batches: the visible batch is drawn every frame, the hidden one never.
+    Only live models get their matrix updated; their bounding box is then projected with the
+    window's view and projection and models outside the view volume are culled. Models are migrated
+    between the batches when they appear or disappear, so the draw cost only depends on the visible
+    models. Every model gets a parent group with its own order, so its material group stays separate
+    in the batch and is drawn with its own matrix.
+    '''
+
+    def __init__(self, win_h, win_w, timeout=MARKER_TIMEOUT):
+        self._win_h = win_h
+        self._win_w = win_w
+        self._timeout = timeout
+        self.batch = pyglet.graphics.Batch()
+        self._hidden_batch = pyglet.graphics.Batch()
+        self.models = []
+        self.live = []
+        self.visible = []
+        self._models_by_id = {}
+
+    def add_model(self, path, id, rot_x=0, rot_y=0, rot_z=0, scaling_factor=1):
+        mdl = Model(path, id, self._win_h, self._win_w, rot_x, rot_y, rot_z, scaling_factor,
+                    batch=self._hidden_batch, group=pyglet.graphics.Group(order=len(self.models)))
+        self.models.append(mdl)
+        self._models_by_id.setdefault(id, []).append(mdl)
+        return mdl
+
+    def update_marker(self, marker_id, view_matrix, position, length, yaw, now):
+        for mdl in self._models_by_id.get(marker_id, ()):
+            mdl.setup_translation(marker_id, view_matrix, position, length)
+            mdl._yaw = yaw
+            mdl._last_seen = now
+
+    def update(self, now, view, projection):
+        live = []
+        visible = []
+        for mdl in self.models:
+            if now - mdl._last_seen > self._timeout:
+                mdl._view_matrix = None
+            if mdl._view_matrix is None or mdl._position is None:
+                mdl.move_to_batch(self._hidden_batch)
+                continue
+            live.append(mdl)
+            # the matrix is needed for culling, hidden models skip this
+            mdl.animate()
+            if mdl.is_on_screen(view, projection):
+                visible.append(mdl)
+                mdl.move_to_batch(self.batch)
+            else:
+                mdl.move_to_batch(self._hidden_batch)
+        self.live = live
+        self.visible = visible
+
+    def draw(self):
+        if self.visible:
+            self.batch.draw()
@@ -1,22 +1,19 @@
 from __future__ import annotations
 
+import argparse
+import sys
 import time
 import math
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Tuple
 
 import cv2
 import cv2.aruco as aruco
 import numpy as np
-from PIL import Image
 import pyglet
-from pyglet.gl import *
 from pyglet.math import Mat4, Vec3
 
-from AR_model import Model
-
-if not hasattr(Model, "id"):
-    Model.id = property(lambda self: getattr(self, "_id", None))
-
 INVERSE_MATRIX = np.array(
     [
         [1.0, 1.0, 1.0, 1.0],
@@ -30,10 +27,11 @@ INVERSE_MATRIX = np.array(
 LASER_LEN = 230
 LASER_TTL = 0.3
 HIT_TTL = 0.3
-LASER_COLOR = (0, 255, 0)
-HIT_COLOR = (0, 0, 255)
-
-lasers: List[Dict[str, object]] = []
+HIT_DISTANCE = 20
+# RGBA, the overlay is drawn with GL and not onto the BGR camera frame
+LASER_COLOR = (0, 255, 0, 255)
+HIT_COLOR = (255, 0, 0, 255)
+MARKER_OUTLINE_COLOR = (0, 255, 0, 255)
 
 ## to convert color space of opencv to color space of pyglet
 ## https://gist.github.com/nkymut/1cb40ea6ae4de0cf9ded7332f1ca0d55
@@ -45,7 +43,7 @@ def cv2glet(img,fmt):
     else:
       rows, cols, channels = img.shape
 
-    raw_img = Image.fromarray(img).tobytes()
+    raw_img = img.tobytes()
 
     top_to_bottom_flag = -1
     bytes_per_row = channels*cols
@@ -97,12 +95,6 @@ win_w = 640
 win_h = 480
 cam_z = 420
 
-window = pyglet.window.Window(win_w, win_h, resizable=False)
-
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    raise RuntimeError("keine webcam gefunden!")
-
 camera_mtx = np.array(
     [
         [534.34144579, 0.0, 339.15527836],
@@ -113,34 +105,85 @@ camera_mtx = np.array(
 )
 dist_coeffs = np.zeros((4, 1))
 
-aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
-aruco_params = aruco.DetectorParameters()
-detector = aruco.ArucoDetector(aruco_dict, aruco_params)
-
-models: List[Model] = [
-    #  Model("enton.obj", 0, win_h, win_w, 270, 90, 270, 0.2), can work with Marker-Sheet 0-3 ID
-    Model("enton.obj", 4, win_h, win_w, 270, 90, 270, 0.2),
-    Model("enton.obj", 5, win_h, win_w, 270, 90, 270, 0.2),
-]
+ASSETS_PATH = Path(__file__).parent
+MODEL_PATH = str(ASSETS_PATH / "enton.obj")
+
+# everything below is created in main(), so importing this module has no side effects
+window = None
+cap = None
+detector = None
+scene = None
+lasers = None
+metrics = None
+frames_captured = None
+frames_dropped = None
+frames_processed = None
+frames_markers_locked = None
+frames_rendered = None
+detection_ms = None
+pose_ms = None
+draw_ms = None
+
+# seconds since main() was called, filled in while starting up
+STARTUP_TIMINGS = {}
+_main_started = None
+_exit_after_first_frame = False
+
+
+def open_camera(device_id=0):
+    '''Opens the webcam and reads one frame, so the camera is warm when the first frame is drawn.'''
+    camera = cv2.VideoCapture(device_id)
+    if not camera.isOpened():
+        raise RuntimeError("keine webcam gefunden!")
+    camera.read()
+    return camera
+
+
+def create_detector():
+    aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
+    aruco_params = aruco.DetectorParameters()
+    return aruco.ArucoDetector(aruco_dict, aruco_params)
+
+
+def create_metrics():
+    '''Creates the registry of the flappy bird game and the counters and histograms used in on_draw().'''
+    global metrics, frames_captured, frames_dropped, frames_processed, frames_markers_locked, frames_rendered
+    global detection_ms, pose_ms, draw_ms
+    # the registry lives next to the flappy bird game, appended so modules of this folder win
+    ar_game_path = str(Path(__file__).resolve().parent.parent / "ar_game")
+    if ar_game_path not in sys.path:
+        sys.path.append(ar_game_path)
+    from telemetry import MetricsRegistry
+
+    metrics = MetricsRegistry()
+    frames_captured = metrics.counter("frames_captured")
+    frames_dropped = metrics.counter("frames_dropped")
+    frames_processed = metrics.counter("frames_processed")
+    frames_markers_locked = metrics.counter("frames_markers_locked")
+    frames_rendered = metrics.counter("frames_rendered")
+    detection_ms = metrics.histogram("detection_ms")
+    pose_ms = metrics.histogram("pose_ms")
+    draw_ms = metrics.histogram("draw_ms")
 
-for m in models:
-    m._last_seen = 0.0
-    m._hit_until = 0.0
-    m._yaw = 0.0
 
-@window.event
 def on_draw():
     ok, frame = cap.read()
     if not ok:
+        frames_dropped.inc()
         return
+    frames_captured.inc()
 
     now = time.time()
 
+    detection_started = time.perf_counter()
     grayFrame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     corners_list, ids, _ = detector.detectMarkers(grayFrame)
-    aruco.drawDetectedMarkers(frame, corners_list)
+    pose_started = time.perf_counter()
+    detection_ms.observe((pose_started - detection_started) * 1000)
+    frames_processed.inc()
 
     if ids is not None:
+        frames_markers_locked.inc()
         for idx, id_arr in enumerate(ids):
             m_id = int(id_arr[0])
             corners = corners_list[idx]
@@ -166,65 +209,81 @@ def on_draw():
 
             cx, cy = map(int, get_center_of_marker(corners[0]))
 
-            for mdl in models:
-                if mdl._id == m_id:
-                    mdl._view_matrix = view_mat
-                    mdl._position = (cx, cy)
-                    mdl._length = length
-                    mdl._last_seen = now
-                    mdl._yaw = yaw
-
-    for mdl in models:
-        if now - mdl._last_seen > 0.5:
-            mdl._view_matrix = None
-
-    for mdl in models:
-        if mdl._view_matrix is None or mdl._position is None:
-            continue
-        sx, sy = mdl._position
-        ex = int(sx + LASER_LEN * math.cos(mdl._yaw))
-        ey = int(sy + LASER_LEN * math.sin(mdl._yaw))
-        lasers.append(
-            {"start": (sx, sy), "end": (ex, ey), "expires": now + LASER_TTL, "owner_id": mdl._id}
-        )
-
-    lasers[:] = [l for l in lasers if l["expires"] > now]
-
-    for laser in lasers:
-        for target in models:
-            if target._id == laser["owner_id"]:
-                continue
-            if target._view_matrix is None or target._position is None:
-                continue
-            if point_line_distance(target._position, laser["start"], laser["end"]) < 20:
-                target._hit_until = now + HIT_TTL
-
-    for laser in lasers:
-        cv2.line(frame, laser["start"], laser["end"], LASER_COLOR, 2)
-
-    for mdl in models:
-        if mdl._position and now < mdl._hit_until:
-            cv2.circle(frame, mdl._position, 25, HIT_COLOR, -1)
+            scene.update_marker(m_id, view_mat, (cx, cy), length, yaw, now)
+        pose_ms.observe((time.perf_counter() - pose_started) * 1000)
+
+    draw_started = time.perf_counter()
+    scene.update(now, window.view, window.projection)
+
+    if scene.live:
+        starts = np.array([mdl._position for mdl in scene.live], dtype=np.float32)
+        yaws = np.array([mdl._yaw for mdl in scene.live], dtype=np.float32)
+        ends = starts + LASER_LEN * np.stack((np.cos(yaws), np.sin(yaws)), axis=1)
+        owners = [mdl._id for mdl in scene.live]
+        lasers.add(starts, ends, owners, np.full(len(owners), now + LASER_TTL))
+
+    lasers.remove_expired(now)
+
+    for target in scene.live:
+        if lasers.is_hit(target._position, target._id, HIT_DISTANCE):
+            target._hit_until = now + HIT_TTL
+
+    lasers.update_vertices([mdl._position for mdl in scene.live if now < mdl._hit_until], corners_list)
 
     pyg_img = cv2glet(frame, "BGR")
     window.clear()
     pyg_img.blit(-win_w / 2, -win_h / 2, 0)
 
-    for mdl in models:
-        if mdl._view_matrix is not None:
-            mdl.batch.draw()
+    lasers.draw()
+    scene.draw()
+    draw_ms.observe((time.perf_counter() - draw_started) * 1000)
+    frames_rendered.inc()
+
+    if "first_frame" not in STARTUP_TIMINGS:
+        STARTUP_TIMINGS["first_frame"] = time.perf_counter() - _main_started
+        if _exit_after_first_frame:
+            pyglet.app.exit()
 
-@window.event
 def on_resize(w: int, h: int):
     window.viewport = (0, 0, w, h)
     window.projection = Mat4.perspective_projection(window.aspect_ratio, 0.1, 1024)
     return pyglet.event.EVENT_HANDLED
 
-def animate(dt: float):
-    for mdl in models:
-        mdl.animate()
+def main(exit_after_first_frame=False, telemetry_path=None, telemetry_interval=10.0):
+    global window, cap, detector, scene, lasers, _main_started, _exit_after_first_frame
+    from pyglet.gl import glEnable, GL_DEPTH_TEST, GL_CULL_FACE
+
+    from AR_model import SceneManager, load_scene
+    from laser_overlay import LaserOverlay
+
+    _main_started = time.perf_counter()
+    _exit_after_first_frame = exit_after_first_frame
+    create_metrics()
+
+    # the camera takes the longest to open, so it warms up while the window and assets are created
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        camera_future = pool.submit(open_camera, 0)
+
+        # window, gl context and the pyglet.model import stay on the main thread,
+        # only the OBJ parsing runs in the worker
+        window = pyglet.window.Window(win_w, win_h, resizable=False)
+        window.push_handlers(on_draw, on_resize)
+        import pyglet.model
+        scene_future = pool.submit(load_scene, MODEL_PATH)
+
+        detector = create_detector()
+        scene_future.result()
+
+        scene = SceneManager(win_h, win_w)
+        #  scene.add_model(MODEL_PATH, 0, 270, 90, 270, 0.2), can work with Marker-Sheet 0-3 ID
+        scene.add_model(MODEL_PATH, 4, 270, 90, 270, 0.2)
+        scene.add_model(MODEL_PATH, 5, 270, 90, 270, 0.2)
+        lasers = LaserOverlay(win_w, win_h, LASER_COLOR, HIT_COLOR, MARKER_OUTLINE_COLOR)
+        STARTUP_TIMINGS["assets_ready"] = time.perf_counter() - _main_started
+
+        cap = camera_future.result()
+        STARTUP_TIMINGS["camera_ready"] = time.perf_counter() - _main_started
 
-if __name__ == "__main__":
     glEnable(GL_DEPTH_TEST)
     glEnable(GL_CULL_FACE)
 
@@ -232,7 +291,23 @@ if __name__ == "__main__":
     window.viewport = (0, 0, win_w, win_h)
     window.projection = Mat4.perspective_projection(window.aspect_ratio, 0.1, 1024)
 
+    # collected all the time, only written to a file with a telemetry path
+    if telemetry_path:
+        metrics.start(telemetry_path, telemetry_interval)
 
+    try:
+        pyglet.app.run()
+    finally:
+        metrics.stop()
+        cap.release()
+    return STARTUP_TIMINGS
 
-    pyglet.clock.schedule_interval(animate, 1 / 60.0)
-    pyglet.app.run()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--telemetry", metavar="FILE",
+                        help="append game and vision metrics as JSON lines to this (rotating) file")
+    parser.add_argument("--telemetry-interval", type=float, default=10.0,
+                        help="seconds between two telemetry lines")
+    args = parser.parse_args()
+    main(telemetry_path=args.telemetry, telemetry_interval=args.telemetry_interval)
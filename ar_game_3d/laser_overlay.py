@@ -0,0 +1,186 @@
+import numpy as np
+import pyglet
+
+# z position of the overlay, slightly in front of the camera frame which is blitted at z=0
+OVERLAY_Z = 1.0
+HIT_RADIUS = 25
+LASER_WIDTH = 2
+OUTLINE_WIDTH = 1
+CIRCLE_SEGMENTS = 24
+
+_vertex_source = """#version 330 core
+    in vec3 position;
+    in vec4 colors;
+    out vec4 vertex_colors;
+
+    uniform WindowBlock
+    {
+        mat4 projection;
+        mat4 view;
+    } window;
+
+    void main()
+    {
+        gl_Position = window.projection * window.view * vec4(position, 1.0);
+        vertex_colors = colors;
+    }
+"""
+
+_fragment_source = """#version 330 core
+    in vec4 vertex_colors;
+    out vec4 final_colors;
+
+    void main()
+    {
+        final_colors = vertex_colors;
+    }
+"""
+
+
+class _TriangleBuffer:
+    '''Vertex list for a variable number of same sized primitives, unused slots stay zero area triangles.'''
+
+    def __init__(self, program, batch, group, vertices_per_item, color, capacity):
+        self._vertices_per_item = vertices_per_item
+        self._color = color
+        self._capacity = capacity
+        count = capacity * vertices_per_item
+        self._vertex_list = program.vertex_list(
+            count, pyglet.gl.GL_TRIANGLES, batch, group,
+            position=("f", np.zeros(count * 3, dtype=np.float32)),
+            colors=("Bn", color * count),
+        )
+
+    def write(self, vertices):
+        # vertices: (items, vertices_per_item, 3), copied into the attribute buffer in one go
+        items = len(vertices)
+        if items > self._capacity:
+            self._capacity = max(items, self._capacity * 2)
+            count = self._capacity * self._vertices_per_item
+            self._vertex_list.resize(count)
+            self._vertex_list.colors[:] = self._color * count
+        data = np.zeros((self._capacity, self._vertices_per_item, 3), dtype=np.float32)
+        data[:items] = vertices
+        np.frombuffer(self._vertex_list.position, dtype=np.float32)[:] = data.ravel()
+
+
+def segment_quads(starts, ends, width):
+    '''Two counter clockwise triangles per segment (world coordinates, y up), width in pixels.'''
+    direction = ends[:, :2] - starts[:, :2]
+    length = np.hypot(direction[:, 0], direction[:, 1])
+    scale = np.divide(width / 2, length, out=np.zeros_like(length), where=length > 0)
+    normal = np.stack((-direction[:, 1], direction[:, 0]), axis=1) * scale[:, None]
+
+    quads = np.empty((len(starts), 6, 3), dtype=np.float32)
+    quads[:, :, 2] = OVERLAY_Z
+    a_right = starts[:, :2] - normal
+    b_right = ends[:, :2] - normal
+    b_left = ends[:, :2] + normal
+    a_left = starts[:, :2] + normal
+    for index, corner in enumerate((a_right, b_right, b_left, a_right, b_left, a_left)):
+        quads[:, index, :2] = corner
+    return quads
+
+
+class LaserOverlay:
+    '''Stores lasers in numpy arrays and draws lasers, hit markers and marker outlines as GL primitives.
+
+    Beams and outlines are thin quads, so they keep their pixel width in a core profile context.
+    All vertex data is written in one bulk copy per buffer and frame, the whole overlay is drawn
+    with batch.draw() and the camera frame itself is never drawn on.
+    '''
+
+    def __init__(self, win_w, win_h, laser_color, hit_color, outline_color, capacity=256, hit_capacity=4):
+        self._win_w = win_w
+        self._win_h = win_h
+
+        self.starts = np.empty((0, 2), dtype=np.float32)
+        self.ends = np.empty((0, 2), dtype=np.float32)
+        self.expires = np.empty(0, dtype=np.float64)
+        self.owners = np.empty(0, dtype=np.int32)
+
+        self.batch = pyglet.graphics.Batch()
+        program = pyglet.graphics.shader.ShaderProgram(
+            pyglet.graphics.shader.Shader(_vertex_source, "vertex"),
+            pyglet.graphics.shader.Shader(_fragment_source, "fragment"),
+        )
+        group = pyglet.graphics.ShaderGroup(program)
+
+        # unit circle as triangle fan (center, p_i, p_i+1), counter clockwise for face culling
+        angles = np.linspace(0.0, 2.0 * np.pi, CIRCLE_SEGMENTS + 1, dtype=np.float32)
+        fan = np.zeros((CIRCLE_SEGMENTS, 3, 2), dtype=np.float32)
+        fan[:, 1, 0] = np.cos(angles[:-1])
+        fan[:, 1, 1] = np.sin(angles[:-1])
+        fan[:, 2, 0] = np.cos(angles[1:])
+        fan[:, 2, 1] = np.sin(angles[1:])
+        self._unit_fan = fan.reshape(-1, 2) * HIT_RADIUS
+
+        self._beams = _TriangleBuffer(program, self.batch, group, 6, laser_color, capacity)
+        self._outlines = _TriangleBuffer(program, self.batch, group, 6, outline_color, 16)
+        self._circles = _TriangleBuffer(program, self.batch, group, len(self._unit_fan), hit_color, hit_capacity)
+
+    def __len__(self):
+        return len(self.expires)
+
+    def add(self, starts, ends, owners, expires):
+        self.starts = np.concatenate((self.starts, np.asarray(starts, dtype=np.float32).reshape(-1, 2)))
+        self.ends = np.concatenate((self.ends, np.asarray(ends, dtype=np.float32).reshape(-1, 2)))
+        self.owners = np.concatenate((self.owners, np.asarray(owners, dtype=np.int32)))
+        self.expires = np.concatenate((self.expires, np.asarray(expires, dtype=np.float64)))
+
+    def remove_expired(self, now):
+        alive = self.expires > now
+        if not alive.all():
+            self.starts = self.starts[alive]
+            self.ends = self.ends[alive]
+            self.owners = self.owners[alive]
+            self.expires = self.expires[alive]
+
+    def is_hit(self, position, target_id, max_distance):
+        mask = self.owners != target_id
+        if not mask.any():
+            return False
+        distances = point_segments_distance(position, self.starts[mask], self.ends[mask])
+        return bool((distances < max_distance).any())
+
+    def _to_world(self, points):
+        # same mapping as the blitted camera frame: origin in the window center, y pointing up
+        world = np.empty((len(points), 3), dtype=np.float32)
+        world[:, 0] = points[:, 0] - self._win_w / 2
+        world[:, 1] = self._win_h / 2 - points[:, 1]
+        world[:, 2] = OVERLAY_Z
+        return world
+
+    def update_vertices(self, hit_positions, marker_corners=()):
+        self._beams.write(segment_quads(self._to_world(self.starts), self._to_world(self.ends), LASER_WIDTH))
+
+        # marker outlines like aruco.drawDetectedMarkers: every corner to the next one
+        if len(marker_corners):
+            corners = np.concatenate([np.asarray(c, dtype=np.float32).reshape(4, 2) for c in marker_corners])
+            following = np.concatenate([np.roll(np.asarray(c, dtype=np.float32).reshape(4, 2), -1, axis=0)
+                                        for c in marker_corners])
+            self._outlines.write(segment_quads(self._to_world(corners), self._to_world(following), OUTLINE_WIDTH))
+        else:
+            self._outlines.write(np.empty((0, 6, 3), dtype=np.float32))
+
+        circles = np.empty((len(hit_positions), len(self._unit_fan), 3), dtype=np.float32)
+        if len(hit_positions):
+            centers = self._to_world(np.asarray(hit_positions, dtype=np.float32).reshape(-1, 2))
+            circles[:, :, :2] = centers[:, None, :2] + self._unit_fan
+            circles[:, :, 2] = OVERLAY_Z
+        self._circles.write(circles)
+
+    def draw(self):
+        self.batch.draw()
+
+
+def point_segments_distance(pt, starts, ends):
+    '''Vectorized point_line_distance: distance of one point to every segment starts[i] -> ends[i].'''
+    p = np.asarray(pt, dtype=np.float32)
+    seg = ends - starts
+    seg_len_sq = (seg * seg).sum(axis=1)
+    rel = p - starts
+    t = np.divide((rel * seg).sum(axis=1), seg_len_sq, out=np.zeros_like(seg_len_sq), where=seg_len_sq > 0)
+    np.clip(t, 0.0, 1.0, out=t)
+    closest = starts + t[:, None] * seg
+    return np.hypot(p[0] - closest[:, 0], p[1] - closest[:, 1])
@@ -0,0 +1,17 @@
+'''Offline benchmarks for the image extractor, the AR flappy bird game and the 3D AR game.'''
+import sys
+from pathlib import Path
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+SUBPROJECT_PATHS = [
+    REPO_PATH / "perspective_transformation",
+    REPO_PATH / "ar_game",
+    REPO_PATH / "ar_game_3d",
+]
+
+
+def add_subproject_paths():
+    # the subprojects are plain script folders that import their siblings directly
+    for path in reversed(SUBPROJECT_PATHS):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
@@ -0,0 +1,362 @@
+'''Benchmarks for the per-frame hot paths of all three subprojects.
+
+Runs offline on synthetic marker images (DICT_6X6_250) or on recorded frames, writes the
+results as JSON and compares them against a baseline file. Recorded frames (--frames) replace the
+synthetic input of the marker detection, inner quad, warp and fingertip benchmarks; for all but
+the detection only frames in which the whole marker sheet is found are used.
+A benchmark of the baseline that did not run (e.g. its setup failed) counts as a regression.
+
+    python -m benchmarks.hot_paths --output bench.json
+    python -m benchmarks.hot_paths --baseline bench.json --output new.json
+    python -m benchmarks.hot_paths --frames recorded_frames/ --filter detect
+'''
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+import types
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+import pyglet
+
+# ImageData needs no GL context, without the shadow window pyglet can be imported without a display
+pyglet.options["shadow_window"] = False
+
+from benchmarks import REPO_PATH, add_subproject_paths
+from benchmarks import synthetic
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+LASER_COUNTS = [10, 100, 1000]
+# default frame budget of the games (ms), the flappy bird update runs at 120 Hz, the 3D game at 60 Hz
+FRAME_BUDGET_MS = 1000 / 60
+DEFAULT_TOLERANCE = 0.2
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    '''Registers a setup function. It gets the options and returns the callable that is timed.'''
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _detector():
+    return aruco.ArucoDetector(synthetic.DICTIONARY, aruco.DetectorParameters())
+
+
+def _detect_sheet(frame):
+    corners, ids, _ = _detector().detectMarkers(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    if ids is None or len(ids) != len(synthetic.SHEET_MARKER_IDS):
+        raise RuntimeError("synthetic marker sheet was not detected")
+    return corners, ids
+
+
+def _recorded_sheets(options):
+    '''(frame, corners, ids, inner quad) of the recorded frames that show the whole sheet, None without --frames.'''
+    if not options.frames:
+        return None
+    from helpers import selectInnerQuadPoints
+    detector = _detector()
+    sheets = []
+    for frame in synthetic.load_recorded_frames(options.frames):
+        corners, ids, _ = detector.detectMarkers(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        if ids is None or len(ids) != len(synthetic.SHEET_MARKER_IDS):
+            continue
+        try:
+            quad = selectInnerQuadPoints(corners, ids, list(synthetic.SHEET_MARKER_IDS))
+        except KeyError:
+            continue
+        sheets.append((frame, corners, ids, quad))
+    if not sheets:
+        raise RuntimeError(f"no recorded frame in {options.frames} shows the whole marker sheet")
+    return sheets
+
+
+def _register_detect_markers(width, height):
+    @benchmark(f"detect_markers[{width}x{height}]")
+    def setup(options):
+        detector = _detector()
+        gray = cv2.cvtColor(synthetic.marker_sheet(width, height), cv2.COLOR_BGR2GRAY)
+        return lambda: detector.detectMarkers(gray)
+
+
+for _width, _height in RESOLUTIONS:
+    _register_detect_markers(_width, _height)
+
+
+@benchmark("detect_markers[recorded]")
+def setup_detect_markers_recorded(options):
+    if not options.frames:
+        return None
+    detector = _detector()
+    grays = itertools.cycle([cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in synthetic.load_recorded_frames(options.frames)])
+    return lambda: detector.detectMarkers(next(grays))
+
+
+@benchmark("inner_quad_selection")
+def setup_inner_quad_selection(options):
+    from helpers import selectInnerQuadPoints
+    recorded = _recorded_sheets(options)
+    if recorded:
+        detections = itertools.cycle([(corners, ids) for _, corners, ids, _ in recorded])
+    else:
+        detections = itertools.repeat(_detect_sheet(synthetic.marker_sheet(1280, 720)))
+    marker_ids = list(synthetic.SHEET_MARKER_IDS)
+
+    def select():
+        corners, ids = next(detections)
+        return selectInnerQuadPoints(corners, ids, marker_ids)
+    return select
+
+
+@benchmark("warp_camera_image_to_whole_screen")
+def setup_warp_camera_image(options):
+    from helpers import selectInnerQuadPoints, warpCameraImageToWholeScreen
+    recorded = _recorded_sheets(options)
+    if recorded:
+        sheets = itertools.cycle([(frame, quad) for frame, _, _, quad in recorded])
+    else:
+        frame = synthetic.marker_sheet(640, 480)
+        corners, ids = _detect_sheet(frame)
+        sheets = itertools.repeat((frame, selectInnerQuadPoints(corners, ids, list(synthetic.SHEET_MARKER_IDS))))
+
+    def warp():
+        frame, quad = next(sheets)
+        return warpCameraImageToWholeScreen(frame, quad)
+    return warp
+
+
+@benchmark("find_highest_visible_fingertip_candidate")
+def setup_fingertip(options):
+    from helpers import SCREEN_WIDTH, SCREEN_HEIGHT, findHighestVisibleFingertipCandidate, warpCameraImageToWholeScreen
+    if hasattr(findHighestVisibleFingertipCandidate, "backgroundModel"):
+        del findHighestVisibleFingertipCandidate.backgroundModel
+    recorded = _recorded_sheets(options)
+    if recorded:
+        # the game searches the warped sheet, not the camera frame
+        frames = itertools.cycle([warpCameraImageToWholeScreen(frame, quad) for frame, _, _, quad in recorded])
+    else:
+        frames = itertools.cycle(synthetic.moving_finger_frames(SCREEN_WIDTH, SCREEN_HEIGHT))
+    findHighestVisibleFingertipCandidate(next(frames))
+    return lambda: findHighestVisibleFingertipCandidate(next(frames))
+
+
+@benchmark("fingertip_tracker_update")
+def setup_fingertip_tracker(options):
+    from helpers import SCREEN_WIDTH, SCREEN_HEIGHT
+    from fingertip_tracker import FingertipTracker
+    tracker = FingertipTracker()
+    recorded = _recorded_sheets(options)
+    if recorded:
+        sheets = itertools.cycle([(frame, quad) for frame, _, _, quad in recorded])
+    else:
+        quad = [(0, 0), (SCREEN_WIDTH - 1, 0), (SCREEN_WIDTH - 1, SCREEN_HEIGHT - 1), (0, SCREEN_HEIGHT - 1)]
+        sheets = ((frame, quad) for frame in itertools.cycle(
+            synthetic.moving_finger_frames(SCREEN_WIDTH, SCREEN_HEIGHT, count=16)))
+
+    def update():
+        frame, quad = next(sheets)
+        return tracker.update(frame, quad, 1 / 30)
+    for _ in range(3):
+        update()
+    return update
+
+
+@benchmark("estimate_pose_marker")
+def setup_estimate_pose(options):
+    import ar_game_3d
+    corners_list, ids, _ = _detector().detectMarkers(
+        cv2.cvtColor(synthetic.marker_pair(640, 480), cv2.COLOR_BGR2GRAY))
+    if ids is None:
+        raise RuntimeError("synthetic 3D markers were not detected")
+    corners = corners_list[0]
+    return lambda: ar_game_3d.estimatePoseMarker(corners, ar_game_3d.camera_mtx, ar_game_3d.dist_coeffs)
+
+
+def _random_lasers(count):
+    rng = np.random.default_rng(4)
+    starts = rng.uniform(0, 640, (count, 2)).astype(np.float32)
+    ends = starts + rng.uniform(-230, 230, (count, 2)).astype(np.float32)
+    return starts, ends
+
+
+def _register_point_line_distance(count):
+    @benchmark(f"point_line_distance[{count}]")
+    def setup(options):
+        from ar_game_3d import point_line_distance
+        starts, ends = _random_lasers(count)
+        segments = [(tuple(map(int, a)), tuple(map(int, b))) for a, b in zip(starts, ends)]
+        return lambda: [point_line_distance((320, 240), a, b) for a, b in segments]
+
+    @benchmark(f"point_segments_distance[{count}]")
+    def setup_vectorized(options):
+        from laser_overlay import point_segments_distance
+        starts, ends = _random_lasers(count)
+        return lambda: point_segments_distance((320, 240), starts, ends)
+
+
+for _count in LASER_COUNTS:
+    _register_point_line_distance(_count)
+
+
+@benchmark("model_animate")
+def setup_model_animate(options):
+    from AR_model import Model
+    # Model.__init__ needs a GL context to upload the mesh, animate() only writes the matrix
+    mdl = Model.__new__(Model)
+    mdl.__dict__.update(
+        _id=4, _win_h=480, _win_w=640, _rot_x=270, _rot_y=90, _rot_z=270, _scaling_factor=0.2,
+        _position=(320, 240), _length=80.0, _view_matrix=np.eye(4, dtype=np.float32),
+        _model=types.SimpleNamespace(matrix=None),
+    )
+    return mdl.animate
+
+
+@benchmark("frame_to_texture[cv2glet 640x480]")
+def setup_cv2glet(options):
+    from ar_game_3d import cv2glet
+    frame = synthetic.marker_pair(640, 480)
+    return lambda: cv2glet(frame, "BGR")
+
+
+@benchmark("frame_to_texture[convertCvFrameToPyglet 1280x720]")
+def setup_convert_cv_frame(options):
+    from helpers import convertCvFrameToPyglet
+    frame = synthetic.marker_sheet(1280, 720)
+    return lambda: convertCvFrameToPyglet(frame)
+
+
+@benchmark("image_extractor_warp")
+def setup_image_extractor(options):
+    from image_extractor import extractRect
+    image = cv2.imread(str(REPO_PATH / "perspective_transformation" / "sample_image.jpg"))
+    h, w = image.shape[:2]
+    points = [(w * 0.1, h * 0.15), (w * 0.85, h * 0.1), (w * 0.9, h * 0.85), (w * 0.15, h * 0.9)]
+    return lambda: extractRect(image, points, 900, 600)
+
+
+def time_callable(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_ms": samples[0],
+        "runs": repeat,
+    }
+
+
+def compare(results, baseline, tolerance, ignored=()):
+    '''Returns the benchmarks whose median got slower than the baseline median by more than tolerance.
+
+    Baseline benchmarks without a result (setup failed, renamed or removed) are returned as
+    regressions too, with a median of None, unless they are in ignored (filtered out or not applicable).
+    '''
+    regressions = []
+    for name in baseline.get("results", {}):
+        if name not in results and name not in ignored:
+            regressions.append({"name": name, "median_ms": None,
+                                "baseline_median_ms": baseline["results"][name]["median_ms"], "ratio": None})
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        ratio = result["median_ms"] / reference["median_ms"] if reference["median_ms"] else float("inf")
+        result["baseline_ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append({"name": name, "median_ms": result["median_ms"],
+                                "baseline_median_ms": reference["median_ms"], "ratio": ratio})
+    return regressions
+
+
+def run(options):
+    add_subproject_paths()
+    results = {}
+    skipped = {}
+    not_applicable = set()
+    for name, setup in BENCHMARKS.items():
+        if options.filter and options.filter not in name:
+            continue
+        try:
+            fn = setup(options)
+            if fn is None:
+                # e.g. recorded detection without --frames
+                not_applicable.add(name)
+                continue
+            result = time_callable(fn, options.repeat, options.warmup)
+        except Exception as error:
+            # e.g. a synthetic image that is no longer detected, compared to a baseline this is a regression
+            print(f"{name:55s} skipped: {error!r}", file=sys.stderr)
+            skipped[name] = repr(error)
+            continue
+        result["budget_share"] = result["median_ms"] / options.budget_ms
+        results[name] = result
+        print(f"{name:55s} median {result['median_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms", file=sys.stderr)
+    return results, skipped, not_applicable
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the results as JSON to this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown of the median relative to the baseline (0.2 = 20%%)")
+    parser.add_argument("--frames", help="folder with recorded camera frames (png/jpg)")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=FRAME_BUDGET_MS)
+    options = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "frame_budget_ms": options.budget_ms,
+            "created": time.time(),
+        },
+    }
+    report["results"], report["skipped"], not_applicable = run(options)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        ignored = not_applicable | {name for name in baseline.get("results", {})
+                                    if options.filter and options.filter not in name}
+        report["regressions"] = compare(report["results"], baseline, options.tolerance, ignored)
+
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for regression in report.get("regressions", []):
+        if regression["median_ms"] is None:
+            print(f"REGRESSION {regression['name']}: did not run "
+                  f"(baseline {regression['baseline_median_ms']:.3f} ms)", file=sys.stderr)
+            continue
+        print(f"REGRESSION {regression['name']}: {regression['median_ms']:.3f} ms "
+              f"(baseline {regression['baseline_median_ms']:.3f} ms)", file=sys.stderr)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+'''Startup benchmark for both games.
+
+Every game is started in a fresh interpreter, so the import time is measured cold.
+Reports the import time of the game module and the time from main() to the first drawn frame.
+
+    python -m benchmarks.startup            # needs a webcam and a display
+    python -m benchmarks.startup --import-only
+'''
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks import REPO_PATH
+
+# name -> (folder, module, keyword argument of main() that quits after the first frame)
+GAMES = {
+    "ar_game": (REPO_PATH / "ar_game", "ar_game", "exitAfterFirstFrame"),
+    "ar_game_3d": (REPO_PATH / "ar_game_3d", "ar_game_3d", "exit_after_first_frame"),
+}
+
+_CHILD_SOURCE = """
+import json, os, sys, time
+os.chdir({folder!r})
+sys.path.insert(0, {folder!r})
+started = time.perf_counter()
+import {module} as game
+result = {{"import": time.perf_counter() - started}}
+if not {import_only!r}:
+    result.update(game.main(**{{{exit_kwarg!r}: True}}))
+print(json.dumps(result))
+"""
+
+
+def measure(name, import_only=False):
+    folder, module, exit_kwarg = GAMES[name]
+    source = _CHILD_SOURCE.format(folder=str(folder), module=module,
+                                  import_only=import_only, exit_kwarg=exit_kwarg)
+    completed = subprocess.run([sys.executable, "-c", source], capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--import-only", action="store_true", help="skip main(), no webcam or display needed")
+    parser.add_argument("--game", choices=sorted(GAMES), action="append")
+    args = parser.parse_args()
+
+    for name in args.game or sorted(GAMES):
+        timings = measure(name, args.import_only)
+        print(json.dumps({"game": name, **{key: round(value, 4) for key, value in timings.items()}}))
+
+
+if __name__ == "__main__":
+    main()
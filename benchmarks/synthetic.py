@@ -0,0 +1,74 @@
+'''Synthetic and recorded input frames for the benchmarks, no webcam needed.'''
+from pathlib import Path
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+DICTIONARY = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
+
+# ids of the flappy bird marker sheet and of the two 3D game markers
+SHEET_MARKER_IDS = (0, 1, 2, 3)
+GAME_3D_MARKER_IDS = (4, 5)
+
+
+def _tilt(frame, amount):
+    # mild perspective distortion so that the sheet is not perfectly axis aligned like in a camera image
+    h, w = frame.shape[:2]
+    dx = w * amount
+    dy = h * amount
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    dst = np.float32([[dx, dy], [w - dx * 0.5, 0], [w, h - dy * 0.5], [0, h]])
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    return cv2.warpPerspective(frame, matrix, (w, h), borderValue=(255, 255, 255))
+
+
+def marker_sheet(width, height, marker_ids=SHEET_MARKER_IDS, marker_fraction=0.2, tilt=0.04):
+    '''BGR frame with one marker in every corner, like the printed marker sheet.'''
+    frame = np.full((height, width, 3), 255, dtype=np.uint8)
+    side = int(min(width, height) * marker_fraction)
+    margin = side // 3
+    positions = [
+        (margin, margin),
+        (width - margin - side, margin),
+        (width - margin - side, height - margin - side),
+        (margin, height - margin - side),
+    ]
+    for marker_id, (x, y) in zip(marker_ids, positions):
+        marker = aruco.generateImageMarker(DICTIONARY, marker_id, side)
+        frame[y:y + side, x:x + side] = marker[:, :, None]
+    return _tilt(frame, tilt)
+
+
+def marker_pair(width, height, marker_ids=GAME_3D_MARKER_IDS, marker_fraction=0.25):
+    '''BGR frame with the two 3D game markers next to each other.'''
+    frame = np.full((height, width, 3), 255, dtype=np.uint8)
+    side = int(min(width, height) * marker_fraction)
+    y = (height - side) // 2
+    for index, marker_id in enumerate(marker_ids):
+        x = (index + 1) * width // (len(marker_ids) + 1) - side // 2
+        marker = aruco.generateImageMarker(DICTIONARY, marker_id, side)
+        frame[y:y + side, x:x + side] = marker[:, :, None]
+    return _tilt(frame, 0.02)
+
+
+def moving_finger_frames(width, height, count=8, finger_width=60):
+    '''BGR frames with a dark finger shaped bar that moves upwards, to create motion for the fingertip search.'''
+    frames = []
+    for index in range(count):
+        frame = np.full((height, width, 3), 200, dtype=np.uint8)
+        x = width // 3 + index * width // (4 * count)
+        tip_y = height // 2 - index * height // (3 * count)
+        cv2.rectangle(frame, (x, tip_y), (x + finger_width, height - 1), (40, 60, 90), -1)
+        frames.append(frame)
+    return frames
+
+
+def load_recorded_frames(folder):
+    '''Loads recorded camera frames (png/jpg) from a folder, sorted by file name.'''
+    paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    frames = [cv2.imread(str(p)) for p in paths]
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        raise FileNotFoundError(f"no recorded frames found in {folder}")
+    return frames